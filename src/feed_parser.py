@@ -4,62 +4,103 @@ Extracts all post URLs from a Blogger RSS/Atom feed
 """
 
 import feedparser
+import functools
 import logging
-from typing import List, Optional
-from urllib.parse import urlparse
+import re
+from typing import Dict, List, Optional
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
+
+try:
+    from lxml import etree
+except ImportError:  # fall back to feedparser for the whole feed
+    etree = None
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+# Shared across parsers so repeated fetches reuse the keep-alive connection
+_session = requests.Session()
 
 
 class BloggerFeedParser:
+    # Post URLs end in .html, optionally followed by a query or fragment
+    _HTML_RE = re.compile(r'\.html($|[?#])')
+    # Static pages, search/label pages, feeds and mobile variants
+    _EXCLUDE_RE = re.compile(r'(/p/|/search|/feeds/|\?m=[01])')
+    
     def __init__(self, feed_url: str):
         """Initialize the feed parser."""
         self.feed_url = feed_url
         self.logger = logging.getLogger(__name__)
+        # feedparser result shared by get_all_post_urls and get_recent_posts
+        self._cached_feed = None
         
-    def get_all_post_urls(self, max_results: int = 500) -> List[str]:
+    def _open_feed(self):
+        """Start streaming the feed; the response is used as a context manager."""
+        response = _session.get(self.feed_url, stream=True, timeout=30)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        response.raw.decode_content = True
+        return response
+        
+    def _parse_feed(self):
+        """Fetch the feed and let feedparser read it straight off the socket."""
+        with self._open_feed() as response:
+            # feedparser expects lowercase header names for encoding detection
+            headers = {k.lower(): v for k, v in response.headers.items()}
+            return feedparser.parse(response.raw, response_headers=headers)
+            
+    def _parsed(self):
+        """Return the parsed feed, fetching it on first use only."""
+        if self._cached_feed is None:
+            self._cached_feed = self._parse_feed()
+        return self._cached_feed
+        
+    def _lxml_extract(self, stream, max_results: Optional[int] = None) -> Dict[str, None]:
         """
-        Get all post URLs from the Blogger feed.
+        Pull post links out of an Atom or RSS feed with lxml's iterparse.
+        
+        Only <link> elements are read, which skips the sanitizing and URI
+        resolution feedparser does for every entry. Parsing stops as soon
+        as max_results valid URLs are found, so the rest of the feed is
+        never read.
         
         Args:
-            max_results: Maximum number of results to fetch
+            stream: File-like object with the raw feed XML
+            max_results: Stop after this many valid URLs
             
         Returns:
-            List of post URLs
+            Ordered dict whose keys are the valid post URLs
         """
-        urls = []
+        urls = {}
         
-        try:
-            # Parse the feed
-            feed = feedparser.parse(self.feed_url)
-            
-            if feed.bozo:
-                self.logger.error(f"Error parsing feed: {feed.bozo_exception}")
-                return urls
+        for _, elem in etree.iterparse(stream, events=('end',), tag=(f'{ATOM_NS}entry', 'item'),
+                                       resolve_entities=False):
+            if elem.tag == 'item':
+                # RSS: <link>https://...</link>
+                candidates = [link.text.strip() for link in elem.iterfind('link') if link.text]
+            else:
+                # Atom: <link rel="alternate" type="text/html" href="https://..."/>
+                candidates = [
+                    link.get('href') for link in elem.iterfind(f'{ATOM_NS}link')
+                    if link.get('rel', 'alternate') == 'alternate'
+                    and link.get('type', 'text/html') == 'text/html'
+                ]
                 
-            # Extract URLs from entries
-            for entry in feed.entries:
-                if hasattr(entry, 'link'):
-                    url = entry.
-
-"""
-Blogger RSS Feed Parser
-Extracts all post URLs from a Blogger RSS/Atom feed
-"""
-
-import feedparser
-import logging
-from typing import List, Optional
-from urllib.parse import urlparse
-import requests
-from datetime import datetime
-
-
-class BloggerFeedParser:
-    def __init__(self, feed_url: str):
-        """Initialize the feed parser."""
-        self.feed_url = feed_url
-        self.logger = logging.getLogger(__name__)
+            for url in candidates:
+                if url and url not in urls and self._is_valid_post_url(url):
+                    urls.setdefault(url, None)
+                    if max_results and len(urls) >= max_results:
+                        return urls
+                        
+            # Drop finished entries so memory stays flat on long feeds
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+                
+        return urls
         
     def get_all_post_urls(self, max_results: int = 500) -> List[str]:
         """
@@ -71,68 +112,65 @@ class BloggerFeedParser:
         Returns:
             List of post URLs
         """
-        urls = []
+        # Keys keep insertion order, so duplicates are dropped as they appear
+        urls = {}
         
         try:
-            # Parse the feed
-            feed = feedparser.parse(self.feed_url)
-            
-            if feed.bozo:
-                self.logger.error(f"Error parsing feed: {feed.bozo_exception}")
-                return urls
+            if etree is not None:
+                # Leaving the block closes the response, abandoning any unread tail
+                with self._open_feed() as response:
+                    valid_urls = list(self._lxml_extract(response.raw, max_results))
+            else:
+                # Parse the feed
+                feed = self._parsed()
                 
-            # Extract URLs from entries
-            for entry in feed.entries:
-                if hasattr(entry, 'link'):
-                    url = entry.link
-                    # Filter out non-post URLs
-                    if self._is_valid_post_url(url):
-                        urls.append(url)
-                        
-                # Also check alternate links
-                if hasattr(entry, 'links'):
-                    for link in entry.links:
-                        if link.get('rel') == 'alternate' and link.get('type') == 'text/html':
-                            url = link.get('href')
-                            if url and self._is_valid_post_url(url):
-                                urls.append(url)
-                                
-            # Remove duplicates while preserving order
-            urls = list(dict.fromkeys(urls))
-            
-            self.logger.info(f"Found {len(urls)} valid post URLs")
-            return urls[:max_results]
+                if feed.bozo:
+                    self.logger.error(f"Error parsing feed: {feed.bozo_exception}")
+                    return []
+                    
+                # Extract URLs from entries
+                for entry in feed.entries:
+                    if hasattr(entry, 'link'):
+                        url = entry.link
+                        if url:
+                            urls.setdefault(url, None)
+                            
+                    # Also check alternate links
+                    if hasattr(entry, 'links'):
+                        for link in entry.links:
+                            if link.get('rel') == 'alternate' and link.get('type') == 'text/html':
+                                url = link.get('href')
+                                if url:
+                                    urls.setdefault(url, None)
+                                    
+                # Filter out non-post URLs
+                valid_urls = [url for url in urls if self._is_valid_post_url(url)]
+                
+            self.logger.info(f"Found {len(valid_urls)} valid post URLs")
+            return valid_urls[:max_results]
             
         except Exception as e:
             self.logger.error(f"Error fetching feed: {str(e)}")
-            return urls
+            return [url for url in urls if self._is_valid_post_url(url)]
             
-    def _is_valid_post_url(self, url: str) -> bool:
+    @staticmethod
+    @functools.lru_cache(maxsize=8192)
+    def _is_valid_post_url(url: str) -> bool:
         """
         Check if a URL is a valid blog post URL.
         
+        Results are cached, since a post's link usually shows up more than
+        once in a feed.
+        
         Args:
             url: URL to validate
             
         Returns:
             True if valid post URL, False otherwise
         """
-        if not url:
-            return False
-            
-        # Parse the URL
-        parsed = urlparse(url)
-        
-        # Check if it's a valid post URL (ends with .html)
-        if parsed.path.endswith('.html'):
-            # Exclude certain paths
-            excluded_paths = ['/p/', '/search', '/feeds/', '?m=1', '?m=0']
-            for excluded in excluded_paths:
-                if excluded in parsed.path or excluded in url:
-                    return False
-            return True
-            
-        return False
+        return (bool(url)
+                and BloggerFeedParser._HTML_RE.search(url) is not None
+                and BloggerFeedParser._EXCLUDE_RE.search(url) is None)
         
     def get_recent_posts(self, days: int = 7) -> List[str]:
         """
@@ -145,15 +183,21 @@ class BloggerFeedParser:
             List of recent post URLs
         """
         recent_urls = []
-        cutoff_date = datetime.now().timestamp() - (days * 86400)
+        # Compare (Y, m, d, H, M, S) tuples directly instead of building datetimes
+        cutoff_tuple = (datetime.now() - timedelta(days=days)).timetuple()[:6]
         
         try:
-            feed = feedparser.parse(self.feed_url)
+            feed = self._parsed()
             
             for entry in feed.entries:
+                # Published never comes after updated, so once an entry was last
+                # updated before the cutoff, the rest of a newest-first feed is too
+                updated = entry.get('updated_parsed') or entry.get('published_parsed')
+                if updated and updated[:6] <= cutoff_tuple:
+                    break
+                    
                 if hasattr(entry, 'published_parsed'):
-                    published = datetime(*entry.published_parsed[:6]).timestamp()
-                    if published > cutoff_date and hasattr(entry, 'link'):
+                    if entry.published_parsed[:6] > cutoff_tuple and hasattr(entry, 'link'):
                         if self._is_valid_post_url(entry.link):
                             recent_urls.append(entry.link)
                             
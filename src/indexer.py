@@ -4,18 +4,24 @@ Google Indexing API Automation for Blogger
 Author: Dr. Carlos Ruiz Viquez
 """
 
-import json
+import atexit
+import itertools
+import queue
+import sqlite3
 import time
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+import orjson
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from ratelimit import limits, sleep_and_retry
 from tqdm import tqdm
 from colorama import init, Fore, Style
 
@@ -25,73 +31,166 @@ from rate_limiter import RateLimiter
 # Initialize colorama for colored output
 init(autoreset=True)
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class ColorFormatter(logging.Formatter):
+    """Colors console log lines by level, or by a `color` passed via `extra`."""
+    
+    LEVEL_COLORS = {
+        logging.WARNING: Fore.YELLOW,
+        logging.ERROR: Fore.RED,
+        logging.CRITICAL: Fore.RED,
+    }
+    
+    def format(self, record: logging.LogRecord) -> str:
+        color = getattr(record, 'color', None) or self.LEVEL_COLORS.get(record.levelno)
+        message = super().format(record)
+        return f"{color}{message}{Style.RESET_ALL}" if color else message
+
+
 class GoogleIndexer:
     def __init__(self, credentials_path: str):
         """Initialize the Google Indexing API client."""
+        self.setup_logging()
         self.credentials_path = credentials_path
+        # httplib2.Http is not thread-safe, so each worker gets its own service
+        self._tls = threading.local()
         self.service = self._build_service()
         self.rate_limiter = RateLimiter()
+        self.requests_per_minute = int(os.getenv('REQUESTS_PER_MINUTE') or 10)
+        # Serializes the check-and-record so workers share the minute window
+        self._rate_lock = threading.Lock()
+        self.state_db_file = Path("data/state.db")
+        # JSON state from older versions, imported into state_db_file once
         self.indexed_urls_file = Path("data/indexed_urls.json")
         self.pending_urls_file = Path("data/pending_urls.json")
-        self.setup_logging()
+        self._db = self._open_state_db()
+        # Writes to indexed not yet committed; committed in batches
+        self._dirty = 0
+        self._flush_every = 25
         
     def setup_logging(self):
         """Configure logging."""
         log_dir = Path("logs")
         log_dir.mkdir(exist_ok=True)
         
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f'logs/indexing_{datetime.now().strftime("%Y%m%d")}.log'),
-                logging.StreamHandler()
-            ]
-        )
+        # Like basicConfig, leave an already configured root logger alone
+        root = logging.getLogger()
+        if not root.handlers:
+            file_handler = logging.FileHandler(f'logs/indexing_{datetime.now().strftime("%Y%m%d")}.log')
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(ColorFormatter(LOG_FORMAT))
+            
+            # Worker threads only enqueue records; the listener thread does the I/O
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            
+            root.addHandler(QueueHandler(log_queue))
+            root.setLevel(logging.INFO)
+            
         self.logger = logging.getLogger(__name__)
         
     def _build_service(self):
         """Build the Google Indexing API service."""
         try:
-            credentials = service_account.Credentials.from_service_account_file(
+            self._creds = service_account.Credentials.from_service_account_file(
                 self.credentials_path,
                 scopes=['https://www.googleapis.com/auth/indexing']
             )
-            service = build('indexing', 'v3', credentials=credentials)
+            service = build('indexing', 'v3', credentials=self._creds, cache_discovery=False)
+            self._tls.service = service
             return service
         except Exception as e:
-            self.logger.error(f"Failed to build service: {str(e)}")
+            self.logger.error("Failed to build service: %s", e)
             raise
             
-    def load_indexed_urls(self) -> Dict[str, datetime]:
-        """Load previously indexed URLs with timestamps."""
+    def _thread_service(self):
+        """Return the calling thread's service, building it on first use."""
+        service = getattr(self._tls, 'service', None)
+        if service is None:
+            service = build('indexing', 'v3', credentials=self._creds, cache_discovery=False)
+            self._tls.service = service
+        return service
+        
+    def _open_state_db(self) -> sqlite3.Connection:
+        """Open the SQLite state store, creating its tables if needed."""
+        self.state_db_file.parent.mkdir(exist_ok=True)
+        db = sqlite3.connect(self.state_db_file, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS indexed (url TEXT PRIMARY KEY, ts REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS pending (url TEXT PRIMARY KEY)")
+        self._import_legacy_state(db)
+        db.commit()
+        return db
+        
+    def _import_legacy_state(self, db: sqlite3.Connection):
+        """Copy indexed/pending URLs from the old JSON files, once per database."""
+        # user_version marks the import as done; checking for empty tables would
+        # re-import stale pending URLs every time the queue drains
+        if db.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+            
         if self.indexed_urls_file.exists():
-            with open(self.indexed_urls_file, 'r') as f:
-                data = json.load(f)
-                # Convert string timestamps back to datetime
-                return {url: datetime.fromisoformat(ts) for url, ts in data.items()}
-        return {}
+            with open(self.indexed_urls_file, 'rb') as f:
+                data = orjson.loads(f.read())
+            db.executemany(
+                "INSERT OR REPLACE INTO indexed (url, ts) VALUES (?, ?)",
+                ((url, datetime.fromisoformat(ts).timestamp()) for url, ts in data.items())
+            )
+            
+        if self.pending_urls_file.exists():
+            with open(self.pending_urls_file, 'rb') as f:
+                data = orjson.loads(f.read())
+            db.executemany("INSERT OR IGNORE INTO pending (url) VALUES (?)", ((url,) for url in data))
+            
+        db.execute("PRAGMA user_version = 1")
+        
+    def get_last_indexed(self, url: str) -> Optional[datetime]:
+        """Return when a URL was last indexed, or None if it never was."""
+        row = self._db.execute("SELECT ts FROM indexed WHERE url = ?", (url,)).fetchone()
+        return datetime.fromtimestamp(row[0]) if row else None
         
-    def save_indexed_urls(self, indexed_urls: Dict[str, datetime]):
-        """Save indexed URLs with timestamps."""
-        data = {url: ts.isoformat() for url, ts in indexed_urls.items()}
-        with open(self.indexed_urls_file, 'w') as f:
-            json.dump(data, f, indent=2)
+    def record_indexed(self, url: str, indexed_at: datetime):
+        """
+        Mark a URL as indexed and drop it from the pending queue.
+        
+        Commits every `_flush_every` calls; call flush_state() to commit the rest.
+        """
+        self._db.execute("INSERT OR REPLACE INTO indexed (url, ts) VALUES (?, ?)", (url, indexed_at.timestamp()))
+        self._db.execute("DELETE FROM pending WHERE url = ?", (url,))
+        self._dirty += 1
+        if self._dirty >= self._flush_every:
+            self.flush_state()
             
+    def flush_state(self):
+        """Commit any state writes still outstanding."""
+        self._db.commit()
+        self._dirty = 0
+        
+    def count_indexed(self) -> int:
+        """Return how many URLs have been indexed."""
+        return self._db.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+        
     def load_pending_urls(self) -> List[str]:
         """Load URLs pending indexing."""
-        if self.pending_urls_file.exists():
-            with open(self.pending_urls_file, 'r') as f:
-                return json.load(f)
-        return []
+        return [url for (url,) in self._db.execute("SELECT url FROM pending ORDER BY rowid")]
+        
+    def add_pending_urls(self, urls: List[str]):
+        """Append URLs to the pending queue, keeping queued ones in place."""
+        self._db.executemany("INSERT OR IGNORE INTO pending (url) VALUES (?)", ((url,) for url in urls))
+        self._db.commit()
         
     def save_pending_urls(self, urls: List[str]):
         """Save URLs pending indexing."""
-        with open(self.pending_urls_file, 'w') as f:
-            json.dump(urls, f, indent=2)
-            
-    @sleep_and_retry
-    @limits(calls=10, period=60)  # 10 calls per minute
+        self._db.execute("DELETE FROM pending")
+        self._db.executemany("INSERT OR IGNORE INTO pending (url) VALUES (?)", ((url,) for url in urls))
+        self._db.commit()
+        
     def request_indexing(self, url: str, update_type: str = "URL_UPDATED") -> bool:
         """
         Request indexing for a single URL.
@@ -109,32 +208,113 @@ class GoogleIndexer:
                 'type': update_type
             }
             
-            response = self.service.urlNotifications().publish(body=body).execute()
-            
-            self.logger.info(f"{Fore.GREEN}✓ Successfully indexed: {url}{Style.RESET_ALL}")
-            self.logger.debug(f"Response: {response}")
+            # Wait for a free slot and claim it; other workers queue on the lock.
+            # Re-check after sleeping, since a 429 elsewhere may have blocked us since
+            with self._rate_lock:
+                while (wait := self.rate_limiter.time_until_next_request(self.requests_per_minute)) > 0:
+                    time.sleep(wait)
+                self.rate_limiter.record_request()
+                
+            response = self._thread_service().urlNotifications().publish(body=body).execute()
             
-            # Update rate limiter
-            self.rate_limiter.record_request()
+            self.logger.info("✓ Successfully indexed: %s", url, extra={'color': Fore.GREEN})
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Response: %s", response)
             
             return True
             
-        except HttpError as e:
+        except Exception as e:
+            self._log_publish_error(url, e)
+            if isinstance(e, HttpError) and e.resp.status == 429:
+                # Pause every worker for a minute, not just this one
+                self.rate_limiter.block_for(60)
+            return False
+            
+    def _log_publish_error(self, url: str, e: Exception):
+        """Log a failed publish call for a URL."""
+        if isinstance(e, HttpError):
             if e.resp.status == 429:
-                self.logger.warning(f"{Fore.YELLOW}⚠ Rate limit hit, backing off...{Style.RESET_ALL}")
-                time.sleep(60)  # Wait 1 minute
-                return False
+                self.logger.warning("⚠ Rate limit hit, backing off...")
             elif e.resp.status == 403:
-                self.logger.error(f"{Fore.RED}✗ Permission denied for {url}. Check service account permissions.{Style.RESET_ALL}")
-                return False
+                self.logger.error("✗ Permission denied for %s. Check service account permissions.", url)
             else:
-                self.logger.error(f"{Fore.RED}✗ HTTP error for {url}: {e}{Style.RESET_ALL}")
-                return False
-        except Exception as e:
-            self.logger.error(f"{Fore.RED}✗ Unexpected error for {url}: {str(e)}{Style.RESET_ALL}")
-            return False
+                self.logger.error("✗ HTTP error for %s: %s", url, e)
+        else:
+            self.logger.error("✗ Unexpected error for %s: %s", url, e)
+            
+    def batch_publish(self, urls: List[str], chunk: int = 100, update_type: str = "URL_UPDATED",
+                      callback: Optional[Callable[[str, bool], None]] = None) -> Dict[str, bool]:
+        """
+        Request indexing for many URLs, sending up to `chunk` per HTTP call.
+        
+        Each batch still counts as one request per URL, so `chunk` is capped at
+        REQUESTS_PER_MINUTE and every batch waits until the minute window has
+        room for all of its publishes.
+        
+        Args:
+            urls: The URLs to index
+            chunk: Publish requests per batch call, at most requests_per_minute
+            update_type: Either "URL_UPDATED" or "URL_DELETED"
+            callback: Called with (url, success) as each result comes back
             
-    def should_reindex(self, url: str, last_indexed: datetime, force: bool = False) -> bool:
+        Returns:
+            Mapping of each URL to whether it was indexed
+        """
+        results = {}
+        
+        def on_publish(request_id, response, exception):
+            url = urls[int(request_id)]
+            
+            if exception is None:
+                self.logger.info("✓ Successfully indexed: %s", url, extra={'color': Fore.GREEN})
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Response: %s", response)
+                results[url] = True
+            else:
+                self._log_publish_error(url, exception)
+                if isinstance(exception, HttpError) and exception.resp.status == 429:
+                    self.rate_limiter.block_for(60)
+                results[url] = False
+                
+            if callback:
+                callback(url, results[url])
+                
+        # A bigger batch could never fit in the per-minute window
+        chunk = max(1, min(chunk, self.requests_per_minute))
+        
+        for start in range(0, len(urls), chunk):
+            batch_urls = urls[start:start + chunk]
+            
+            while (wait := self.rate_limiter.time_until_next_request(self.requests_per_minute,
+                                                                     len(batch_urls))) > 0:
+                time.sleep(wait)
+                
+            # Every publish in the batch counts against the quota
+            self.rate_limiter.record_request(len(batch_urls))
+            
+            batch = self.service.new_batch_http_request(callback=on_publish)
+            for i, url in enumerate(batch_urls, start):
+                body = {
+                    'url': url,
+                    'type': update_type
+                }
+                # Positions rather than URLs as ids, since ids must be unique
+                batch.add(self.service.urlNotifications().publish(body=body), request_id=str(i))
+                
+            try:
+                batch.execute()
+            except Exception as e:
+                self.logger.error("✗ Batch request failed: %s", e)
+                for url in batch_urls:
+                    if url not in results:
+                        results[url] = False
+                        if callback:
+                            callback(url, False)
+                            
+        return results
+        
+    def should_reindex(self, url: str, last_indexed: datetime, force: bool = False,
+                       now: Optional[datetime] = None) -> bool:
         """
         Determine if a URL should be reindexed.
         
@@ -142,6 +322,7 @@ class GoogleIndexer:
             url: The URL to check
             last_indexed: When it was last indexed
             force: Force reindexing regardless of time
+            now: Reference time, so batch callers can compute it once
             
         Returns:
             True if should reindex, False otherwise
@@ -150,9 +331,9 @@ class GoogleIndexer:
             return True
             
         # Reindex if older than 7 days
-        days_old = (datetime.now() - last_indexed).days
+        days_old = ((now or datetime.now()) - last_indexed).days
         if days_old > 7:
-            self.logger.info(f"URL last indexed {days_old} days ago, reindexing: {url}")
+            self.logger.info("URL last indexed %d days ago, reindexing: %s", days_old, url)
             return True
             
         return False
@@ -165,57 +346,88 @@ class GoogleIndexer:
             urls: List of URLs to index
             force: Force reindexing even if recently indexed
         """
-        indexed_urls = self.load_indexed_urls()
+        indexed_count = 0
         pending_urls = []
+        daily_limit = int(os.getenv('MAX_REQUESTS_PER_DAY', 200))
         
         # Check daily limit
-        if self.rate_limiter.daily_requests >= int(os.getenv('MAX_REQUESTS_PER_DAY', 200)):
-            self.logger.warning(f"{Fore.YELLOW}Daily limit reached. Saving URLs for tomorrow.{Style.RESET_ALL}")
+        if self.rate_limiter.daily_requests >= daily_limit:
+            self.logger.warning("Daily limit reached. Saving URLs for tomorrow.")
             self.save_pending_urls(urls)
             return
             
         print(f"\n{Fore.CYAN}Starting batch indexing of {len(urls)} URLs...{Style.RESET_ALL}\n")
         
-        with tqdm(total=len(urls), desc="Indexing Progress", unit="url") as pbar:
-            for url in urls:
-                # Check if already indexed recently
-                if url in indexed_urls and not self.should_reindex(url, indexed_urls[url], force):
-                    self.logger.info(f"Skipping recently indexed URL: {url}")
+        try:
+            with tqdm(total=len(urls), desc="Indexing Progress", unit="url") as pbar:
+                # Skip URLs indexed recently before submitting anything
+                to_index = []
+                now = datetime.now()
+                for url in urls:
+                    last_indexed = self.get_last_indexed(url)
+                    if last_indexed and not self.should_reindex(url, last_indexed, force, now):
+                        self.logger.info("Skipping recently indexed URL: %s", url)
+                        pbar.update(1)
+                    else:
+                        to_index.append(url)
+                        
+                def record_result(url: str, success: bool):
+                    # Only called on this thread, so state writes need no lock
+                    nonlocal indexed_count
+                    if success:
+                        self.record_indexed(url, datetime.now())
+                        indexed_count += 1
+                    else:
+                        pending_urls.append(url)
+                        
                     pbar.update(1)
-                    continue
-                    
-                # Check daily limit
-                if self.rate_limiter.daily_requests >= int(os.getenv('MAX_REQUESTS_PER_DAY', 200)):
-                    self.logger.warning("Daily limit reached, saving remaining URLs")
-                    pending_urls.extend(urls[urls.index(url):])
-                    break
                     
-                # Request indexing
-                success = self.request_indexing(url)
-                
-                if success:
-                    indexed_urls[url] = datetime.now()
-                    self.save_indexed_urls(indexed_urls)
+                # Batched publishing is opt-in; BATCH_SIZE alone keeps the threaded path
+                if os.getenv('BATCH_PUBLISH', '').lower() in ('1', 'true', 'yes'):
+                    batch_size = int(os.getenv('BATCH_SIZE') or self.requests_per_minute)
+                    # Batches are sized up front, so trim to today's remaining quota
+                    allowed = max(0, daily_limit - self.rate_limiter.daily_requests)
+                    if len(to_index) > allowed:
+                        self.logger.warning("Daily limit reached, saving remaining URLs")
+                        pending_urls.extend(to_index[allowed:])
+                    self.batch_publish(to_index[:allowed], chunk=batch_size, callback=record_result)
                 else:
-                    pending_urls.append(url)
+                    requests_before = self.rate_limiter.daily_requests
                     
-                pbar.update(1)
-                
-                # Small delay between requests
-                time.sleep(2)
-                
+                    with ThreadPoolExecutor(max_workers=int(os.getenv('INDEX_WORKERS', 4))) as executor:
+                        try:
+                            futures = {}
+                            for i, url in enumerate(to_index):
+                                # Check daily limit, counting requests already submitted
+                                if requests_before + len(futures) >= daily_limit:
+                                    self.logger.warning("Daily limit reached, saving remaining URLs")
+                                    pending_urls.extend(to_index[i:])
+                                    break
+                                    
+                                futures[executor.submit(self.request_indexing, url)] = url
+                                
+                            for future in as_completed(futures):
+                                record_result(futures[future], future.result())
+                        except BaseException:
+                            # Otherwise __exit__ waits for every queued publish to go out
+                            # with nobody left to record the results
+                            executor.shutdown(wait=False, cancel_futures=True)
+                            raise
+                            
+        finally:
+            # Commit whatever record_indexed has not committed yet
+            self.flush_state()
+            
         # Save any pending URLs
         if pending_urls:
-            existing_pending = self.load_pending_urls()
-            all_pending = list(set(existing_pending + pending_urls))
-            self.save_pending_urls(all_pending)
-            self.logger.info(f"Saved {len(pending_urls)} URLs for later processing")
+            self.add_pending_urls(pending_urls)
+            self.logger.info("Saved %d URLs for later processing", len(pending_urls))
             
         # Summary
         print(f"\n{Fore.GREEN}Indexing Complete!{Style.RESET_ALL}")
-        print(f"Successfully indexed: {len(indexed_urls)}")
+        print(f"Successfully indexed: {indexed_count} (total {self.count_indexed()})")
         print(f"Pending: {len(pending_urls)}")
-        print(f"Daily requests used: {self.rate_limiter.daily_requests}/{os.getenv('MAX_REQUESTS_PER_DAY', 200)}")
+        print(f"Daily requests used: {self.rate_limiter.daily_requests}/{daily_limit}")
         
     def get_indexing_status(self, url: str) -> Optional[Dict]:
         """
@@ -231,7 +443,7 @@ class GoogleIndexer:
             response = self.service.urlNotifications().getMetadata(url=url).execute()
             return response
         except Exception as e:
-            self.logger.error(f"Failed to get status for {url}: {str(e)}")
+            self.logger.error("Failed to get status for %s: %s", url, e)
             return None
 
 
@@ -267,10 +479,8 @@ def main():
     pending_urls = indexer.load_pending_urls()
     if pending_urls:
         print(f"{Fore.YELLOW}Found {len(pending_urls)} pending URLs from previous run{Style.RESET_ALL}")
-        urls = pending_urls + urls
-        
-    # Remove duplicates
-    urls = list(dict.fromkeys(urls))
+        # Pending URLs go first; duplicates are dropped in the same pass
+        urls = list(dict.fromkeys(itertools.chain(pending_urls, urls)))
     
     # Start batch indexing
     indexer.batch_index_urls(urls)
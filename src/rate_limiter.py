@@ -3,32 +3,46 @@ Rate limiter for Google Indexing API
 Tracks daily and per-minute request limits
 """
 
-import json
+import atexit
+import os
+import threading
 import time
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List
 
+import orjson
+
 
 class RateLimiter:
     def __init__(self):
         """Initialize the rate limiter."""
         self.data_file = Path("data/rate_limit_data.json")
         self.data_file.parent.mkdir(exist_ok=True)
+        # Requests are recorded from indexing worker threads
+        self._lock = threading.RLock()
+        # Requests recorded since the last save; flushed in batches and at exit
+        self._dirty = 0
+        self._flush_every = 10
+        # Set after a 429 so every caller backs off, not just the one that got it
+        self.blocked_until = 0.0
         self.load_data()
+        atexit.register(self.save_data)
         
     def load_data(self):
         """Load rate limiting data from file."""
         if self.data_file.exists():
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
+            with open(self.data_file, 'rb') as f:
+                data = orjson.loads(f.read())
                 self.daily_requests = data.get('daily_requests', 0)
                 self.last_reset = datetime.fromisoformat(data.get('last_reset', datetime.now().isoformat()))
-                self.minute_requests = data.get('minute_requests', [])
+                # Oldest first, so expired timestamps can be popped from the left
+                self.minute_requests = deque(sorted(data.get('minute_requests', [])))
         else:
             self.daily_requests = 0
             self.last_reset = datetime.now()
-            self.minute_requests = []
+            self.minute_requests = deque()
             
         # Reset daily counter if needed
         if datetime.now().date() > self.last_reset.date():
@@ -38,65 +52,106 @@ class RateLimiter:
             
     def save_data(self):
         """Save rate limiting data to file."""
-        data = {
-            'daily_requests': self.daily_requests,
-            'last_reset': self.last_reset.isoformat(),
-            'minute_requests': self.minute_requests
-        }
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f)
+        with self._lock:
+            data = {
+                'daily_requests': self.daily_requests,
+                'last_reset': self.last_reset,
+                'minute_requests': list(self.minute_requests)
+            }
+            # Write a temp file and swap it in so a crash never leaves torn JSON
+            tmp_file = self.data_file.with_suffix('.tmp')
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(data))
+            os.replace(tmp_file, self.data_file)
+            self._dirty = 0
             
-    def record_request(self):
-        """Record a new request."""
-        now = time.time()
-        
-        # Add to minute requests
-        self.minute_requests.append(now)
-        
-        # Clean old minute requests (older than 60 seconds)
-        self.minute_requests = [t for t in self.minute_requests if t > now - 60]
+    def _expire_minute_requests(self, now: float):
+        """Drop timestamps that have left the 60 second window."""
+        while self.minute_requests and self.minute_requests[0] <= now - 60:
+            self.minute_requests.popleft()
+            
+    def record_request(self, count: int = 1):
+        """
+        Record new requests.
         
-        # Increment daily counter
-        self.daily_requests += 1
+        Args:
+            count: Number of requests made, e.g. the size of a batch call
+        """
+        with self._lock:
+            now = time.time()
+            
+            # Add to minute requests
+            self.minute_requests.extend([now] * count)
+            
+            # Clean old minute requests (older than 60 seconds)
+            self._expire_minute_requests(now)
+            
+            # Increment daily counter
+            self.daily_requests += count
+            
+            self._dirty += count
+            if self._dirty >= self._flush_every:
+                self.save_data()
         
-        self.save_data()
+    def block_for(self, seconds: float):
+        """
+        Hold off all requests for a while, e.g. after the API returned 429.
         
-    def can_make_request(self, requests_per_minute: int = 10) -> bool:
+        Args:
+            seconds: How long to wait before the next request
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+            
+    def can_make_request(self, requests_per_minute: int = 10, count: int = 1) -> bool:
         """
         Check if we can make another request.
         
         Args:
             requests_per_minute: Maximum requests per minute
+            count: Number of requests about to be made, e.g. a batch call
             
         Returns:
             True if request is allowed, False otherwise
         """
-        now = time.time()
-        
-        # Clean old minute requests
-        self.minute_requests = [t for t in self.minute_requests if t > now - 60]
-        
-        # Check minute limit
-        if len(self.minute_requests) >= requests_per_minute:
-            return False
+        with self._lock:
+            now = time.time()
+            
+            if now < self.blocked_until:
+                return False
+                
+            # Clean old minute requests
+            self._expire_minute_requests(now)
             
-        return True
+            # Check minute limit
+            if len(self.minute_requests) + count > requests_per_minute:
+                return False
+                
+            return True
         
-    def time_until_next_request(self, requests_per_minute: int = 10) -> float:
+    def time_until_next_request(self, requests_per_minute: int = 10, count: int = 1) -> float:
         """
         Calculate seconds until next request is allowed.
         
         Args:
             requests_per_minute: Maximum requests per minute
+            count: Number of requests about to be made; must not exceed
+                requests_per_minute
             
         Returns:
             Seconds to wait, 0 if can request now
         """
-        if self.can_make_request(requests_per_minute):
-            return 0
+        with self._lock:
+            if self.can_make_request(requests_per_minute, count):
+                return 0
+                
+            now = time.time()
+            wait_time = self.blocked_until - now
             
-        now = time.time()
-        oldest_request = min(self.minute_requests)
-        wait_time = 60 - (now - oldest_request) + 1
-        
-        return max(0, wait_time)
+            # Wait for enough of the oldest requests to expire to fit `count` more
+            overflow = len(self.minute_requests) + count - requests_per_minute
+            if overflow > 0:
+                blocking_request = self.minute_requests[overflow - 1]
+                wait_time = max(wait_time, 60 - (now - blocking_request) + 1)
+            
+            return max(0, wait_time)